@@ -0,0 +1,91 @@
+"""
+Checks the fused CSR kernel of nets/gat_fused.py.
+The fused GATConv forward and its gradients for x, att and bias are compared
+with the propagate path, with and without self-loops, and the kernel is
+gradchecked with and without attention dropout.
+Needs a CUDA device and Triton. Run from src/: python check_gat_fused.py
+"""
+import torch
+from torch_sparse import SparseTensor, set_diag
+
+from nets import gat_fused
+from nets.gat import GATConv, SingleHeadGATConv
+
+
+def make_graph(num_nodes, num_edges, num_isolated, device):
+    # the last num_isolated nodes get no incoming edges, so without
+    # self-loops they cover the empty rows of the CSR
+    src = torch.randint(0, num_nodes, (num_edges,), device=device)
+    dst = torch.randint(0, num_nodes - num_isolated, (num_edges,), device=device)
+    return torch.stack([src, dst], dim=0)
+
+
+def run(conv, x, edge_index, grad_out, is_add_self_loops, fused):
+    is_available = gat_fused.is_available
+    if not fused:
+        gat_fused.is_available = lambda x: False
+    try:
+        x = x.clone().requires_grad_()
+        out = conv(x, edge_index, is_add_self_loops=is_add_self_loops)
+        out.backward(grad_out)
+    finally:
+        gat_fused.is_available = is_available
+    grads = {'x': x.grad, 'lin': conv.lin_l.weight.grad.clone(),
+             'att': conv.att.grad.clone(), 'bias': conv.bias.grad.clone()}
+    conv.zero_grad()
+    return out.detach(), grads
+
+
+def check_against_propagate(device):
+    N, F_in = 50, 16
+    x = torch.randn(N, F_in, device=device)
+    edge_index = make_graph(N, 300, 5, device)
+    convs = [GATConv(F_in, 8, heads=4, use_fused=True),
+             GATConv(F_in, 8, heads=4, concat=False, use_fused=True),
+             SingleHeadGATConv(F_in, 7, use_fused=True),
+             SingleHeadGATConv(F_in, 7, concat=False, use_fused=True)]
+    for conv in convs:
+        # eval mode, so neither path drops attention coefficients
+        conv = conv.to(device).eval()
+        torch.nn.init.normal_(conv.bias)
+        for is_add_self_loops in (True, False):
+            out_channels = conv.heads * conv.out_channels if conv.concat else conv.out_channels
+            grad_out = torch.randn(N, out_channels, device=device)
+            out_ref, grads_ref = run(conv, x, edge_index, grad_out, is_add_self_loops, fused=False)
+            out, grads = run(conv, x, edge_index, grad_out, is_add_self_loops, fused=True)
+            name = '{} self_loops={}'.format(conv, is_add_self_loops)
+            assert torch.allclose(out, out_ref, atol=1e-4, rtol=1e-3), name + ' out'
+            for key, grad in grads.items():
+                assert torch.allclose(grad, grads_ref[key], atol=1e-4, rtol=1e-3), name + ' grad ' + key
+            print(name, 'ok')
+
+
+def check_gradcheck(device):
+    N, H, C = 12, 2, 4
+    edge_index = make_graph(N, 40, 2, device)
+    for is_add_self_loops in (True, False):
+        adj_t = SparseTensor(row=edge_index[1], col=edge_index[0], sparse_sizes=(N, N))
+        if is_add_self_loops:
+            adj_t = set_diag(adj_t)
+        rowptr, col, _ = adj_t.csr()
+        row = adj_t.storage.row()
+        for dropout in (0., 0.3):
+            def fn(x, att_l, att_r, bias):
+                # the seed comes from the default generator, so reseeding
+                # replays the same dropout mask on every evaluation
+                torch.manual_seed(0)
+                return gat_fused.gat_csr_forward(x, att_l, att_r, rowptr, row, col, 0.2,
+                                                 dropout=dropout, bias=bias)[0]
+            inputs = [torch.randn(N, H, C), torch.randn(H, C), torch.randn(H, C), torch.randn(H * C)]
+            inputs = [t.to(device, torch.float64).requires_grad_() for t in inputs]
+            # the kernel accumulates in float32, hence the loose tolerances
+            assert torch.autograd.gradcheck(fn, inputs, eps=1e-3, atol=1e-2, rtol=1e-2)
+            print('gradcheck self_loops={} dropout={} ok'.format(is_add_self_loops, dropout))
+
+
+if __name__ == '__main__':
+    if not (torch.cuda.is_available() and gat_fused.triton is not None):
+        raise SystemExit('needs a CUDA device and Triton')
+    torch.manual_seed(0)
+    check_against_propagate('cuda')
+    check_gradcheck('cuda')
@@ -83,6 +83,7 @@ def main():
     parser.add_argument('--epoch_gen', type=int, default=3, help='The epoches of generator')   #3
     parser.add_argument('--epoch_dis', type=int, default=500, help='The epoches of discriminator')
     parser.add_argument('--fastmode', action='store_true', default=False,help='Validate during training pass.')
+    parser.add_argument('--use_sdpa_dense', action='store_true', default=False, help='SDPA attention for dense graphs in the GAT encoder.')
     parser.add_argument('--alpha', type=float, default=0.2, help='Alpha for the leaky_relu.')
     parser.add_argument('--patience', type=int, default=1000, help='Patience')
 
@@ -153,7 +154,7 @@ def main():
                                    nlayer=4, nembed=args.nembed).to(device)
     elif args.model == 'gat':
         encoder = create_gat(nfeat=data.x.shape[1], nhid=args.nhid, nclass=num_classes, dropout=args.dropout,
-                             nlayer=3, nembed=args.nembed).to(device)
+                             nlayer=3, nembed=args.nembed, use_sdpa_dense=args.use_sdpa_dense).to(device)
         discriminator = create_gat(nfeat=data.x.shape[1], nhid=args.nhid, nclass=num_classes, dropout=args.dropout,
                                 nlayer=4, nembed=args.nembed).to(device)
     elif args.model == 'gcn':
@@ -12,15 +12,27 @@ from torch.nn import Parameter
 import torch.nn as nn
 import torch.nn.functional as F
 import math
+import functools
 import scipy
 import numpy as np
 
 from torch_scatter import scatter_add
 from torch_sparse import SparseTensor, set_diag
 from torch_geometric.nn.conv import MessagePassing
-from torch_geometric.utils import remove_self_loops, add_self_loops, softmax, to_dense_batch
+from torch_geometric.utils import softmax, to_dense_batch
 
-from torch_geometric.nn.inits import reset, glorot, zeros
+from torch_geometric.nn.inits import reset
+
+from . import gat_fused
+
+def _graph_key(edge_index: Adj):
+    # keyed on the data rather than the object, so fresh views of the same
+    # graph (e.g. edge_index.detach()) map to the same key; callers hold a
+    # reference to the graph so its storage (and id) cannot be reused
+    if isinstance(edge_index, Tensor):
+        return (edge_index.data_ptr(), tuple(edge_index.size()),
+                edge_index.stride(), edge_index._version)
+    return id(edge_index)
 
 class GATConv(MessagePassing):
     r"""The graph attentional operator from the `"Graph Attention Networks"
@@ -57,6 +69,15 @@ class GATConv(MessagePassing):
             self-loops to the input graph. (default: :obj:`True`)
         bias (bool, optional): If set to :obj:`False`, the layer will not learn
             an additive bias. (default: :obj:`True`)
+        use_sdpa_dense (bool, optional): If set to :obj:`True`, (nearly) dense
+            graphs are handled by
+            :meth:`torch.nn.functional.scaled_dot_product_attention` with the
+            adjacency as mask. This replaces the additive GAT attention with a
+            dot-product approximation. (default: :obj:`False`)
+        use_fused (bool, optional): If set to :obj:`True`, training forwards
+            also run the fused Triton kernel and its custom backward. Without
+            it the kernel is only used when autograd is disabled.
+            (default: :obj:`False`)
         **kwargs (optional): Additional arguments of
             :class:`torch_geometric.nn.conv.MessagePassing`.
     """
@@ -65,7 +86,8 @@ class GATConv(MessagePassing):
     def __init__(self, in_channels: Union[int, Tuple[int, int]],
                  out_channels: int, heads: int = 1, concat: bool = True,
                  negative_slope: float = 0.2, dropout: float = 0.0,
-                 bias: bool = True, **kwargs):
+                 bias: bool = True, use_sdpa_dense: bool = False,
+                 use_fused: bool = False, **kwargs):
         kwargs.setdefault('aggr', 'add')
         super(GATConv, self).__init__(node_dim=0, **kwargs)
 
@@ -75,17 +97,25 @@ class GATConv(MessagePassing):
         self.concat = concat
         self.negative_slope = negative_slope
         self.dropout = dropout
-
+        self.use_sdpa_dense = use_sdpa_dense
+        self.use_fused = use_fused
+        self.sdpa_dense_threshold = 1 << 20
+
+        # the projections are padded to a multiple of 16 output features so
+        # the GEMM stays on the tensor-core fast path; the padding rows are
+        # zero and are sliced off after the projection
+        self._pad_out = ((heads * out_channels + 15) // 16) * 16
         if isinstance(in_channels, int):
-            self.temp_weight = torch.nn.Linear(in_channels, heads * out_channels, bias=False)
+            self.temp_weight = torch.nn.Linear(in_channels, self._pad_out, bias=False)
             self.lin_l = self.temp_weight#Linear(in_channels, heads * out_channels, bias=False)
-            self.lin_r = self.lin_l
+            # both sides share one projection, which is computed once per forward
+            self.lin_r = None
         else:
-            self.lin_l = torch.nn.Linear(in_channels[0], heads * out_channels, False)
-            self.lin_r = torch.nn.Linear(in_channels[1], heads * out_channels, False)
+            self.lin_l = torch.nn.Linear(in_channels[0], self._pad_out, False)
+            self.lin_r = torch.nn.Linear(in_channels[1], self._pad_out, False)
 
-        self.att_l = Parameter(torch.Tensor(1, heads, out_channels))
-        self.att_r = Parameter(torch.Tensor(1, heads, out_channels))
+        # att[:, 0] scores the source side and att[:, 1] the target side
+        self.att = Parameter(torch.Tensor(*self._att_shape()))
 
         if bias and concat:
             self.bias = Parameter(torch.Tensor(heads * out_channels))
@@ -95,16 +125,60 @@ class GATConv(MessagePassing):
             self.register_parameter('bias', None)
 
         self._alpha = None
+        self._return_alpha = False
+        self._cached_adj_t = None
 
         self.reset_parameters()
 
 
     def reset_parameters(self):
-        glorot(self.lin_l.weight)
-        glorot(self.lin_r.weight)
-        glorot(self.att_l)
-        glorot(self.att_r)
-        zeros(self.bias)
+        HC = self.heads * self.out_channels
+        for lin in (self.lin_l, self.lin_r):
+            if lin is not None:
+                nn.init.xavier_uniform_(lin.weight[:HC])
+                nn.init.zeros_(lin.weight[HC:])
+        # both attention vectors are initialized by one call on the stacked
+        # parameter, scaled for the LeakyReLU that follows them
+        nn.init.xavier_uniform_(self._att_fan_view(), gain=nn.init.calculate_gain(
+            'leaky_relu', self.negative_slope))
+        if self.bias is not None:
+            nn.init.zeros_(self.bias)
+        self._cached_adj_t = None
+
+    def _att_shape(self) -> Tuple[int, ...]:
+        return (self.heads, 2, self.out_channels)
+
+    def _att_fan_view(self) -> Tensor:
+        # the [H, 2, C] view whose fans the initialization uses
+        return self.att
+
+    @property
+    def att_l(self) -> Tensor:
+        return self.att[:, 0]
+
+    @property
+    def att_r(self) -> Tensor:
+        return self.att[:, 1]
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        # older checkpoints store the two attention vectors separately,
+        # as [H, C] or [1, H, C]
+        key_l, key_r = prefix + 'att_l', prefix + 'att_r'
+        if key_l in state_dict and key_r in state_dict:
+            H, C = self.heads, self.out_channels
+            state_dict[prefix + 'att'] = torch.stack(
+                [state_dict.pop(key_l).view(H, C), state_dict.pop(key_r).view(H, C)], dim=1)
+        att = state_dict.get(prefix + 'att')
+        if att is not None and att.shape != self.att.shape and att.numel() == self.att.numel():
+            state_dict[prefix + 'att'] = att.view_as(self.att)
+        # and unpadded projection weights
+        for name in ('temp_weight', 'lin_l', 'lin_r'):
+            key = prefix + name + '.weight'
+            weight = state_dict.get(key)
+            if weight is not None and weight.size(0) < self._pad_out:
+                state_dict[key] = torch.cat(
+                    [weight, weight.new_zeros(self._pad_out - weight.size(0), weight.size(1))])
+        super(GATConv, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
 
     def forward(self, x: Union[Tensor, OptPairTensor], edge_index: Adj,
                 size: Size = None, return_attention_weights=None, is_add_self_loops: bool = True):
@@ -115,67 +189,183 @@ class GATConv(MessagePassing):
                 :obj:`(edge_index, attention_weights)`, holding the computed
                 attention weights for each edge. (default: :obj:`None`)
         """
-        H, C = self.heads, self.out_channels
-        original_size = edge_index.shape[1]
-        x_l: OptTensor = None
-        x_r: OptTensor = None
-        alpha_l: OptTensor = None
-        alpha_r: OptTensor = None
-
         if isinstance(x, Tensor):
-            assert x.dim() == 2, 'Static graphs not supported in `GATConv`.'
-            #x_lyy = x_r = self.lin_l(x).view(-1, H, C)
-            x = self.lin_l(x) #.view(-1, H, C)
-            x_l = x_r = x.view(-1,H,C)
-
-            alpha_l = (x_l * self.att_l).sum(dim=-1)
-            alpha_r = (x_r * self.att_r).sum(dim=-1)
+            return self._forward_single(x, edge_index, size,
+                                        return_attention_weights, is_add_self_loops)
+        return self._forward_pair(x, edge_index, size,
+                                  return_attention_weights, is_add_self_loops)
+
+    def _forward_single(self, x: Tensor, edge_index: Adj, size: Size = None,
+                        return_attention_weights=None, is_add_self_loops: bool = True):
+        assert x.dim() == 2, 'Static graphs not supported in `GATConv`.'
+        x_l = self._project(self.lin_l, x)
+
+        if return_attention_weights is None:
+            out = self._fast_path(x_l, edge_index, size, is_add_self_loops)
+            if out is not None:
+                return out
+
+        alpha_l, alpha_r = torch.einsum('nhc,hkc->nhk', x_l, self.att).unbind(-1)
+        return self._attend(x_l, x_l, alpha_l, alpha_r, edge_index, size,
+                            return_attention_weights, is_add_self_loops)
+
+    def _forward_pair(self, x: OptPairTensor, edge_index: Adj, size: Size = None,
+                      return_attention_weights=None, is_add_self_loops: bool = True):
+        H, C = self.heads, self.out_channels
+        x_l, x_r = x[0], x[1]
+        assert x_l.dim() == 2, 'Static graphs not supported in `GATConv`.'
+        x_l_proj = self._project(self.lin_l, x_l)
+        if x_r is None:
+            x_r_proj = None
+        elif self.lin_r is None and x_r is x_l:
+            x_r_proj = x_l_proj
         else:
-            x_l, x_r = x[0], x[1]
-            assert x[0].dim() == 2, 'Static graphs not supported in `GATConv`.'
-            x_l = self.lin_l(x_l).view(-1, H, C)
-            alpha_l = (x_l * self.att_l).sum(dim=-1)
-            if x_r is not None:
-                x_r = self.lin_r(x_r).view(-1, H, C)
-                alpha_r = (x_r * self.att_r).sum(dim=-1)
+            lin_r = self.lin_l if self.lin_r is None else self.lin_r
+            x_r_proj = self._project(lin_r, x_r)
+        x_l, x_r = x_l_proj, x_r_proj
 
-        assert x_l is not None
-        assert alpha_l is not None
-
-        if is_add_self_loops:
-            if isinstance(edge_index, Tensor):
-                num_nodes = x_l.size(0)
-                if x_r is not None:
-                    num_nodes = min(num_nodes, x_r.size(0))
-                if size is not None:
-                    num_nodes = min(size[0], size[1])
-                edge_index, _ = remove_self_loops(edge_index)
-                edge_index, _ = add_self_loops(edge_index, num_nodes=num_nodes)
-            elif isinstance(edge_index, SparseTensor):
-                edge_index = set_diag(edge_index)
+        alpha_l = torch.einsum('nhc,hc->nh', x_l, self.att_l.view(H, C))
+        alpha_r: OptTensor = None
+        if x_r is not None:
+            alpha_r = torch.einsum('nhc,hc->nh', x_r, self.att_r.view(H, C))
+        return self._attend(x_l, x_r, alpha_l, alpha_r, edge_index, size,
+                            return_attention_weights, is_add_self_loops)
+
+    def _fast_path(self, x: Tensor, edge_index: Adj, size: Size,
+                   is_add_self_loops: bool) -> OptTensor:
+        # runs the whole layer on [N, H, C] features without propagate, or
+        # returns None when no such path applies
+        N = x.size(0)
+        # both paths handle one row per node of a square graph; bipartite
+        # sizes and mismatched adjacencies go through _attend
+        if size is not None:
+            return None
+        if isinstance(edge_index, SparseTensor) and edge_index.sparse_sizes() != (N, N):
+            return None
+
+        if self.use_sdpa_dense and self._is_dense(edge_index, N):
+            return self._finalize(self._sdpa_dense(x, edge_index, is_add_self_loops))
+
+        if gat_fused.is_available(x) and (self.use_fused or not torch.is_grad_enabled()):
+            adj_t = self.csr_adj(edge_index, N, is_add_self_loops)
+            rowptr, col, _ = adj_t.csr()
+            # the kernel adds the bias when it stores the output; averaging
+            # heads afterwards keeps it exact since mean_h(out_h + b) = mean_h(out_h) + b
+            out, _ = gat_fused.gat_csr_forward(
+                x, self.att_l, self.att_r, rowptr, adj_t.storage.row(), col,
+                self.negative_slope, self.dropout if self.training else 0.,
+                bias=self.bias, csr32=gat_fused.csr32_of(adj_t))
+            return self._finalize(out, add_bias=False)
+        return None
+
+    def _project(self, lin: nn.Linear, x: Tensor) -> Tensor:
+        H, C = self.heads, self.out_channels
+        x = lin(x)
+        if self._pad_out != H * C:
+            x = x[:, :H * C]
+        return x.view(-1, H, C)
+
+    def _attend(self, x_l: Tensor, x_r: OptTensor, alpha_l: Tensor,
+                alpha_r: OptTensor, edge_index: Adj, size: Size,
+                return_attention_weights, is_add_self_loops: bool):
+        num_src = x_l.size(0)
+        num_dst = x_r.size(0) if x_r is not None else num_src
+        if size is not None:
+            num_src, num_dst = size[0], size[1]
+        # sorting the edges by target once lets softmax and aggregation
+        # walk CSR segments instead of scattering with atomics
+        adj_t = self.csr_adj(edge_index, num_src, is_add_self_loops, num_dst)
+
+        self._return_alpha = isinstance(return_attention_weights, bool)
         # propagate_type: (x: OptPairTensor, alpha: OptPairTensor)
-        out = self.propagate(edge_index, x=(x_l, x_r),
+        out = self.propagate(adj_t, x=(x_l, x_r),
                              alpha=(alpha_l, alpha_r), size=size)
 
         alpha = self._alpha
         self._alpha = None
 
+        out = self._finalize(out)
+
+        if isinstance(return_attention_weights, bool):
+            assert alpha is not None
+            if isinstance(edge_index, Tensor):
+                row, col, _ = adj_t.coo()
+                return out, (torch.stack([col, row], dim=0), alpha)
+            elif isinstance(edge_index, SparseTensor):
+                return out, adj_t.set_value(alpha, layout='coo')
+        return out
+
+    def _finalize(self, out: Tensor, add_bias: bool = True) -> Tensor:
         if self.concat:
             out = out.view(-1, self.heads * self.out_channels)
         else:
-            out = out.mean(dim=1)
+            # a mean over a single head is only a reshape
+            out = out.mean(dim=1) if self.heads > 1 else out.squeeze(1)
 
-        if self.bias is not None:
+        if add_bias and self.bias is not None:
             out += self.bias
+        return out
 
-        if isinstance(return_attention_weights, bool):
-            assert alpha is not None
-            if isinstance(edge_index, Tensor):
-                return out, (edge_index, alpha)
-            elif isinstance(edge_index, SparseTensor):
-                return out, edge_index.set_value(alpha, layout='coo')
+    def _is_dense(self, edge_index: Adj, num_nodes: int) -> bool:
+        if not hasattr(F, 'scaled_dot_product_attention'):
+            return False
+        if isinstance(edge_index, SparseTensor):
+            num_edges = edge_index.nnz()
+        else:
+            num_edges = edge_index.size(1)
+        num_pairs = num_nodes * num_nodes
+        return num_pairs <= self.sdpa_dense_threshold or 2 * num_edges >= num_pairs
+
+    def _sdpa_dense(self, x: Tensor, edge_index: Adj,
+                    is_add_self_loops: bool) -> Tensor:
+        N = x.size(0)
+        if isinstance(edge_index, SparseTensor):
+            row, col, _ = edge_index.coo()
         else:
-            return out, edge_index
+            row, col = edge_index[1], edge_index[0]
+        # attn_mask[i, j] is True when target i attends to source j
+        attn_mask = torch.zeros(N, N, dtype=torch.bool, device=x.device)
+        attn_mask[row, col] = True
+        if is_add_self_loops:
+            attn_mask.fill_diagonal_(True)
+        # SDPA returns NaN for an all-False row, so isolated targets attend to
+        # themselves and get a zero output below
+        empty = ~attn_mask.any(dim=-1)
+        attn_mask.diagonal().logical_or_(empty)
+
+        q = (x * self.att_r).transpose(0, 1).unsqueeze(0)
+        k = (x * self.att_l).transpose(0, 1).unsqueeze(0)
+        v = x.transpose(0, 1).unsqueeze(0)
+        out = F.scaled_dot_product_attention(
+            q, k, v, attn_mask=attn_mask,
+            dropout_p=self.dropout if self.training else 0.)
+        out = out.masked_fill(empty.view(1, 1, N, 1), 0.)
+        return out.squeeze(0).transpose(0, 1).contiguous()
+
+    def csr_adj(self, edge_index: Adj, num_nodes: int, is_add_self_loops: bool,
+                num_dst: Optional[int] = None) -> SparseTensor:
+        r"""Returns :obj:`edge_index` as a target-major :class:`SparseTensor`,
+        with self-loops if requested. The result for the last graph is cached,
+        so repeated calls on the same graph do not rebuild it."""
+        if isinstance(edge_index, SparseTensor) and not is_add_self_loops:
+            return edge_index
+
+        num_dst = num_nodes if num_dst is None else num_dst
+        key = (_graph_key(edge_index), num_nodes, num_dst, is_add_self_loops)
+        cache = self._cached_adj_t
+        if cache is not None and cache[1] == key:
+            return cache[2]
+
+        # rows of the returned adjacency are the target nodes
+        if isinstance(edge_index, SparseTensor):
+            adj_t = edge_index
+        else:
+            adj_t = SparseTensor(row=edge_index[1], col=edge_index[0],
+                                 sparse_sizes=(num_dst, num_nodes))
+        if is_add_self_loops:
+            adj_t = set_diag(adj_t)
+        self._cached_adj_t = (edge_index, key, adj_t)
+        return adj_t
 
     def message(self, x_j: Tensor, alpha_j: Tensor, alpha_i: OptTensor,
                 index: Tensor, ptr: OptTensor,
@@ -183,28 +373,98 @@ class GATConv(MessagePassing):
         alpha = alpha_j if alpha_i is None else alpha_j + alpha_i
         alpha = F.leaky_relu(alpha, self.negative_slope)
         alpha = softmax(alpha, index, ptr, size_i)
-        self._alpha = alpha
-        alpha = F.dropout(alpha, p=self.dropout, training=self.training)
-        return x_j * alpha.unsqueeze(-1)
+        if self._return_alpha:
+            self._alpha = alpha
+            alpha = F.dropout(alpha, p=self.dropout, training=self.training)
+        else:
+            # nothing else reads the coefficients, so drop out in place
+            alpha = F.dropout(alpha, p=self.dropout, training=self.training, inplace=True)
+        return x_j * alpha.unsqueeze(-1).to(x_j.dtype)
 
     def __repr__(self):
         return '{}({}, {}, heads={})'.format(self.__class__.__name__,
                                              self.in_channels,
                                              self.out_channels, self.heads)
 
+class SingleHeadGATConv(GATConv):
+    r"""A :class:`GATConv` with a single attention head. Features and
+    attention scores carry no head dimension, so the head reshapes, the
+    head-wise einsum and the mean over heads are skipped.
+    Args:
+        in_channels (int): Size of each input sample.
+        out_channels (int): Size of each output sample.
+        **kwargs (optional): Additional arguments of :class:`GATConv`.
+    """
+    def __init__(self, in_channels: int, out_channels: int, **kwargs):
+        assert isinstance(in_channels, int)
+        kwargs['heads'] = 1
+        super(SingleHeadGATConv, self).__init__(in_channels, out_channels, **kwargs)
+
+    def _att_shape(self) -> Tuple[int, ...]:
+        # att[0] scores the source side and att[1] the target side
+        return (2, self.out_channels)
+
+    def _att_fan_view(self) -> Tensor:
+        # initialize with the fans of the multi-head [1, 2, C] layout
+        return self.att.view(1, 2, self.out_channels)
+
+    @property
+    def att_l(self) -> Tensor:
+        return self.att[0]
+
+    @property
+    def att_r(self) -> Tensor:
+        return self.att[1]
+
+    def _forward_single(self, x: Tensor, edge_index: Adj, size: Size = None,
+                        return_attention_weights=None, is_add_self_loops: bool = True):
+        assert x.dim() == 2, 'Static graphs not supported in `GATConv`.'
+        x = self.lin_l(x)[:, :self.out_channels]
+
+        if return_attention_weights is None:
+            out = self._fast_path(x.unsqueeze(1), edge_index, size, is_add_self_loops)
+            if out is not None:
+                return out
+
+        alpha_l, alpha_r = (x @ self.att.t()).unbind(-1)
+        return self._attend(x, x, alpha_l, alpha_r, edge_index, size,
+                            return_attention_weights, is_add_self_loops)
+
+    def _finalize(self, out: Tensor, add_bias: bool = True) -> Tensor:
+        out = out.view(-1, self.out_channels)
+        if add_bias and self.bias is not None:
+            out += self.bias
+        return out
+
+def amp_forward(forward):
+    r"""Runs a model's :obj:`forward` under bfloat16 autocast when
+    :obj:`self.use_amp` is set and the input lives on a GPU with bfloat16
+    support, and casts the outputs back to the input dtype."""
+    @functools.wraps(forward)
+    def wrapper(self, x, *args, **kwargs):
+        if not (self.use_amp and x.is_cuda and torch.cuda.is_bf16_supported()):
+            return forward(self, x, *args, **kwargs)
+        with torch.autocast('cuda', dtype=torch.bfloat16):
+            out = forward(self, x, *args, **kwargs)
+        if isinstance(out, tuple):
+            return tuple(o.to(x.dtype) for o in out)
+        return out.to(x.dtype)
+    return wrapper
+
 class StandGAT1(nn.Module):
     def __init__(self, nfeat, nhid, nclass, dropout,nlayer=1, is_add_self_loops=True):
         super(StandGAT1, self).__init__()
-        self.conv1 = GATConv(nfeat, nclass,heads=1)
+        self.conv1 = SingleHeadGATConv(nfeat, nclass)
 
         self.is_add_self_loops = is_add_self_loops
+        self.use_amp = True
         self.reg_params = []
         self.non_reg_params = self.conv1.parameters()
 
+    @amp_forward
     def forward(self, x, adj, edge_weight=None):
 
-        edge_index = adj
-        x, edge_index = self.conv1(x,edge_index, is_add_self_loops=self.is_add_self_loops)
+        x = self.conv1(x, adj, is_add_self_loops=self.is_add_self_loops)
         x = F.relu(x)
 
         return x
@@ -218,19 +478,21 @@ class StandGAT2(nn.Module):
         head_dim = nhid//num_head
 
         self.conv1 = GATConv(nfeat, head_dim, heads=num_head)
-        self.conv2 = GATConv(nhid,  nclass,   heads=1, concat=False)
+        self.conv2 = SingleHeadGATConv(nhid, nclass, concat=False)
         self.dropout_p = dropout
         self.is_add_self_loops = True
+        self.use_amp = True
 
         self.reg_params = list(self.conv1.parameters())
         self.non_reg_params = self.conv2.parameters()
 
+    @amp_forward
     def forward(self, x, adj, edge_weight=None):
-        edge_index = adj
-        x, edge_index = self.conv1(x, edge_index, is_add_self_loops=self.is_add_self_loops)
+        edge_index = self.conv1.csr_adj(adj, x.size(0), self.is_add_self_loops)
+        x = self.conv1(x, edge_index, is_add_self_loops=False)
         x = F.relu(x)
         x = F.dropout(x, p= self.dropout_p, training=self.training)
-        x, edge_index = self.conv2(x, edge_index, is_add_self_loops=self.is_add_self_loops)
+        x = self.conv2(x, edge_index, is_add_self_loops=False)
         return x
 
 class StandGATX(nn.Module):
@@ -241,50 +503,101 @@ class StandGATX(nn.Module):
         head_dim = nhid//num_head
 
         self.conv1 = GATConv(nfeat, head_dim, heads=num_head)
-        self.conv2 = GATConv(nhid, nclass)
+        self.conv2 = SingleHeadGATConv(nhid, nclass)
         self.convx = nn.ModuleList([GATConv(nhid, head_dim, heads=num_head) for _ in range(nlayer-2)])
         self.dropout_p = dropout
         self.is_add_self_loops = True
+        self.use_amp = True
 
         self.reg_params = list(self.conv1.parameters()) + list(self.convx.parameters())
         self.non_reg_params = self.conv2.parameters()
 
+        # replay inference forwards from a captured CUDA graph; optimizer
+        # steps update the parameters in place, so the capture stays valid
+        self.use_cuda_graph = False
+        self._cuda_graph = None
 
+    @amp_forward
     def forward(self, x, adj, edge_weight=None):
-        edge_index = adj
-        x, edge_index = self.conv1(x, edge_index, is_add_self_loops=self.is_add_self_loops)
+        if (self.use_cuda_graph and not self.training and x.is_cuda
+                and not torch.is_grad_enabled()):
+            return self._graphed_forward(x, adj)
+        return self._forward(x, adj)
+
+    def _graphed_forward(self, x, adj):
+        key = (_graph_key(adj), x.shape, x.dtype, x.device,
+               torch.is_autocast_enabled(), torch.get_autocast_gpu_dtype())
+        cache = self._cuda_graph
+        if cache is None or cache[1] != key:
+            # the captured kernels read the CSR buffers of adj_t and their
+            # int32 copies, so the capture keeps all of them alive; the
+            # per-layer caches alone would drop them on the next graph
+            adj_t = self.conv1.csr_adj(adj, x.size(0), self.is_add_self_loops)
+            csr32 = gat_fused.csr32_of(adj_t) if gat_fused.is_available(x) else None
+            static_x = x.clone()
+            # the autocast weight cache lives outside the graph pool and is
+            # freed on exit, so casts must be recorded inside the graph
+            with torch.autocast('cuda', dtype=torch.bfloat16,
+                                enabled=torch.is_autocast_enabled(), cache_enabled=False):
+                # warm up on a side stream so one-off work (CSR pointers,
+                # kernel compilation) stays out of the captured graph
+                stream = torch.cuda.Stream()
+                stream.wait_stream(torch.cuda.current_stream())
+                with torch.cuda.stream(stream):
+                    for _ in range(3):
+                        self._layers(static_x, adj_t)
+                torch.cuda.current_stream().wait_stream(stream)
+
+                graph = torch.cuda.CUDAGraph()
+                with torch.cuda.graph(graph):
+                    static_out = self._layers(static_x, adj_t)
+            self._cuda_graph = ((adj, adj_t, csr32), key, graph, static_x, static_out)
+        else:
+            _, _, graph, static_x, static_out = cache
+            static_x.copy_(x)
+        graph.replay()
+        return static_out.clone()
+
+    def _forward(self, x, adj):
+        # self-loops are added once here and shared by every layer
+        edge_index = self.conv1.csr_adj(adj, x.size(0), self.is_add_self_loops)
+        return self._layers(x, edge_index)
+
+    def _layers(self, x, edge_index):
+        x = self.conv1(x, edge_index, is_add_self_loops=False)
         x = F.relu(x)
 
         for iter_layer in self.convx:
             x = F.dropout(x, p= self.dropout_p, training=self.training)
-            x, edge_index = iter_layer(x, edge_index, is_add_self_loops=self.is_add_self_loops)
+            x = iter_layer(x, edge_index, is_add_self_loops=False)
             x = F.relu(x)
 
         x = F.dropout(x,p= self.dropout_p,  training=self.training)
-        x, edge_index = self.conv2(x, edge_index,edge_weight, is_add_self_loops=self.is_add_self_loops)
+        x = self.conv2(x, edge_index, is_add_self_loops=False)
 
         return x
 
 class StandGATEncoder(nn.Module):
-    def __init__(self, nfeat, nhid, nembed, dropout, is_add_self_loops=True):
+    def __init__(self, nfeat, nhid, nembed, dropout, is_add_self_loops=True, use_sdpa_dense=False):
         super(StandGATEncoder, self).__init__()
         num_head = 8
         head_dim = nhid // num_head
         head_dim_2 = nembed//num_head
-        self.conv1 = GATConv(nfeat, head_dim_2, heads=num_head)
+        self.conv1 = GATConv(nfeat, head_dim_2, heads=num_head, use_sdpa_dense=use_sdpa_dense)
         self.conv2 = GATConv(nhid, head_dim_2, heads=num_head)
         self.dropout = dropout
 
         self.is_add_self_loops = is_add_self_loops
+        self.use_amp = True
 
 
+    @amp_forward
     def forward(self, x, adj, edge_weight=None):
 
-        edge_index = adj
-        x, edge_index = self.conv1(x,edge_index, is_add_self_loops=self.is_add_self_loops)
+        x = self.conv1(x, adj, is_add_self_loops=self.is_add_self_loops)
         x = F.dropout(x, self.dropout, training=self.training)
         x = F.elu(x)
-        #x, edge_index = self.conv2(x, edge_index, is_add_self_loops=self.is_add_self_loops)
+        #x = self.conv2(x, adj, is_add_self_loops=self.is_add_self_loops)
         #x = F.dropout(x, self.dropout, training=self.training)
         #x = F.elu(x)
 
@@ -297,34 +610,54 @@ class StandGATClssifier(nn.Module):
         head_dim = nhid // num_head
 
         self.conv1 = GATConv(nembed, head_dim, heads=num_head)
-        self.conv2 = GATConv(nhid, nclass, heads=1, concat=False)
+        self.conv2 = SingleHeadGATConv(nhid, nclass, concat=False)
         self.fakereal = nn.Linear(nhid,2)
         self.dropout_p = dropout
         self.is_add_self_loops = True
+        self.use_amp = True
 
         self.reset_parameters()
 
     def reset_parameters(self):
             nn.init.normal_(self.fakereal.weight, std=0.05)
 
+    @amp_forward
     def forward(self, x, adj, edge_weight=None):
-        edge_index = adj
-        x, edge_index = self.conv1(x, edge_index, is_add_self_loops=self.is_add_self_loops)
-        x = F.relu(x)
-        x = F.dropout(x, p=self.dropout_p, training=self.training)
-        logits, edge_index = self.conv2(x, edge_index, is_add_self_loops=self.is_add_self_loops)
-        fakeorreal = self.fakereal(x)
+        logits, fakeorreal = self._logits(x, adj)
         x_class = F.log_softmax(logits, dim=1)  # 这个地方要不要F.elu
         x_fakereal = F.log_softmax(fakeorreal, dim=1)  # 这个地方改成log_softmax还是softmax
         return logits, fakeorreal, x_class, x_fakereal
 
-def create_gat(nfeat, nhid, nclass, dropout, nlayer, nembed=64):
-    if nlayer == 1:
-        model = StandGAT1(nfeat, nhid, nclass, dropout,nlayer)
-    elif nlayer == 2:
-        model = StandGAT2(nfeat, nhid, nclass, dropout,nlayer)
-    elif nlayer == 3:
-        model = StandGATEncoder(nfeat, nhid, nembed, dropout)
-    elif nlayer == 4:
-        model = StandGATClssifier(nhid, nembed, nclass, dropout)
+    @amp_forward
+    def forward_for_loss(self, x, adj, edge_weight=None):
+        r"""Returns only the raw class and real/fake logits. Train with
+        :obj:`F.cross_entropy(logits, y)`, which fuses the log-softmax into
+        the loss, instead of :obj:`F.nll_loss` on the log-probabilities
+        returned by :meth:`forward`."""
+        return self._logits(x, adj)
+
+    def _logits(self, x, adj):
+        edge_index = self.conv1.csr_adj(adj, x.size(0), self.is_add_self_loops)
+        x = self.conv1(x, edge_index, is_add_self_loops=False)
+        x = F.relu(x)
+        x = F.dropout(x, p=self.dropout_p, training=self.training)
+        logits = self.conv2(x, edge_index, is_add_self_loops=False)
+        fakeorreal = self.fakereal(x)
+        return logits, fakeorreal
+
+_GAT_BUILDERS = {
+    1: lambda nfeat, nhid, nclass, dropout, nembed, use_sdpa_dense: StandGAT1(nfeat, nhid, nclass, dropout, 1),
+    2: lambda nfeat, nhid, nclass, dropout, nembed, use_sdpa_dense: StandGAT2(nfeat, nhid, nclass, dropout, 2),
+    3: lambda nfeat, nhid, nclass, dropout, nembed, use_sdpa_dense: StandGATEncoder(nfeat, nhid, nembed, dropout,
+                                                                                    use_sdpa_dense=use_sdpa_dense),
+    4: lambda nfeat, nhid, nclass, dropout, nembed, use_sdpa_dense: StandGATClssifier(nhid, nembed, nclass, dropout),
+}
+
+def create_gat(nfeat, nhid, nclass, dropout, nlayer, nembed=64, use_compile=False, use_sdpa_dense=False):
+    # use_sdpa_dense only applies to the encoder (nlayer=3)
+    model = _GAT_BUILDERS[nlayer](nfeat, nhid, nclass, dropout, nembed, use_sdpa_dense)
+    if use_compile and hasattr(torch, 'compile'):
+        # inductor fuses the pointwise chains around the attention logits;
+        # the SparseTensor/propagate calls still break the graph
+        model = torch.compile(model, backend='inductor', mode='reduce-overhead')
     return model
@@ -0,0 +1,228 @@
+"""
+Fused CSR attention for GATConv.
+One Triton program per (target node, head) streams the neighbours of the node,
+computes the LeakyReLU logits, normalizes them with an online softmax and
+accumulates sum_j alpha_ij * x_j in registers, so neither the [E, H] attention
+nor the [E, H, C] message tensor is ever written to memory.
+The backward pass rebuilds the attention from the per-row logsumexp saved by
+the forward kernel, so it needs no max or normalizer pass over the edges either.
+"""
+from typing import Optional, Tuple
+import weakref
+
+import torch
+from torch import Tensor
+import torch.nn.functional as F
+from torch_scatter import scatter_add, segment_csr
+from torch_sparse import SparseTensor
+
+try:
+    import triton
+    import triton.language as tl
+except ImportError:
+    triton = None
+
+
+if triton is not None:
+    @triton.jit
+    def _gat_csr_fwd(x_ptr, att_l_ptr, att_r_ptr, rowptr_ptr, col_ptr, bias_ptr,
+                     out_ptr, lse_ptr, N, H, C, stride_xn, neg_slope, dropout_p, seed,
+                     HAS_BIAS: tl.constexpr, BIAS_PER_HEAD: tl.constexpr,
+                     BLOCK_C: tl.constexpr, BLOCK_N: tl.constexpr):
+        i = tl.program_id(0)
+        h = tl.program_id(1)
+        stride_n = H * C
+
+        offs_c = tl.arange(0, BLOCK_C)
+        mask_c = offs_c < C
+        att_l = tl.load(att_l_ptr + h * C + offs_c, mask=mask_c, other=0.).to(tl.float32)
+        att_r = tl.load(att_r_ptr + h * C + offs_c, mask=mask_c, other=0.).to(tl.float32)
+
+        # the target side of the logit is shared by the whole row
+        x_i = tl.load(x_ptr + i.to(tl.int64) * stride_xn + h * C + offs_c, mask=mask_c, other=0.).to(tl.float32)
+        alpha_i = tl.sum(x_i * att_r, axis=0)
+
+        start = tl.load(rowptr_ptr + i)
+        end = tl.load(rowptr_ptr + i + 1)
+
+        m = tl.full([], float('-inf'), dtype=tl.float32)
+        l = tl.zeros([], dtype=tl.float32)
+        acc = tl.zeros([BLOCK_C], dtype=tl.float32)
+        for off in range(start, end, BLOCK_N):
+            offs_n = off + tl.arange(0, BLOCK_N)
+            mask_n = offs_n < end
+            # widen before the row offset so int32 indices cannot overflow it
+            j = tl.load(col_ptr + offs_n, mask=mask_n, other=0).to(tl.int64)
+            x_j = tl.load(x_ptr + j[:, None] * stride_xn + h * C + offs_c[None, :],
+                          mask=mask_n[:, None] & mask_c[None, :], other=0.).to(tl.float32)
+
+            e = alpha_i + tl.sum(x_j * att_l[None, :], axis=1)
+            e = tl.where(e > 0, e, e * neg_slope)
+            e = tl.where(mask_n, e, float('-inf'))
+
+            m_new = tl.maximum(m, tl.max(e, axis=0))
+            scale = tl.exp(m - m_new)
+            p = tl.exp(e - m_new)
+            l = l * scale + tl.sum(p, axis=0)
+            if dropout_p > 0:
+                # the normalizer is taken before dropout, as in F.dropout(softmax(e))
+                r = tl.rand(seed, (offs_n * H + h).to(tl.int32))
+                p = tl.where(r >= dropout_p, p / (1 - dropout_p), 0.)
+            acc = acc * scale + tl.sum(p[:, None] * x_j, axis=0)
+            m = m_new
+
+        # rows without edges (no self-loops) aggregate to zero
+        out = tl.where(l > 0, acc / l, 0.)
+        if HAS_BIAS:
+            # the layer bias is folded into the store instead of a separate
+            # elementwise pass over the output
+            if BIAS_PER_HEAD:
+                out += tl.load(bias_ptr + h * C + offs_c, mask=mask_c, other=0.).to(tl.float32)
+            else:
+                out += tl.load(bias_ptr + offs_c, mask=mask_c, other=0.).to(tl.float32)
+        tl.store(out_ptr + i.to(tl.int64) * stride_n + h * C + offs_c,
+                 out.to(out_ptr.dtype.element_ty), mask=mask_c)
+        tl.store(lse_ptr + i * H + h, m + tl.log(l))
+
+    @triton.jit
+    def _dropout_keep(keep_ptr, numel, dropout_p, seed, BLOCK: tl.constexpr):
+        # regenerates the forward dropout mask; edge e of head h used the
+        # random offset e * H + h, which is the flat index into [E, H]
+        offs = tl.program_id(0) * BLOCK + tl.arange(0, BLOCK)
+        r = tl.rand(seed, offs)
+        tl.store(keep_ptr + offs, (r >= dropout_p).to(tl.int8), mask=offs < numel)
+
+
+def is_available(x: Tensor) -> bool:
+    return triton is not None and x.is_cuda
+
+
+def to_csr32(rowptr: Tensor, col: Tensor) -> Optional[Tuple[Tensor, Tensor]]:
+    r"""Returns int32 copies of a CSR adjacency, or :obj:`None` if its
+    indices do not fit into 32 bits."""
+    if rowptr.numel() > 2 ** 31 - 1 or col.numel() > 2 ** 31 - 1:
+        return None
+    return rowptr.to(torch.int32), col.to(torch.int32)
+
+
+# SparseTensor insists on int64 indices while the kernel only needs int32, so
+# the int32 copies are cached next to each adjacency. Every layer that runs on
+# the same SparseTensor shares one entry, which is dropped when it is freed.
+_csr32_cache = {}
+
+
+def csr32_of(adj_t: SparseTensor) -> Optional[Tuple[Tensor, Tensor]]:
+    r"""Returns the int32 CSR copies of :obj:`adj_t` (see :func:`to_csr32`),
+    built once per adjacency."""
+    key = id(adj_t)
+    entry = _csr32_cache.get(key)
+    if entry is None or entry[0]() is not adj_t:
+        rowptr, col, _ = adj_t.csr()
+        ref = weakref.ref(adj_t, lambda _, key=key: _csr32_cache.pop(key, None))
+        entry = (ref, to_csr32(rowptr, col))
+        _csr32_cache[key] = entry
+    return entry[1]
+
+
+def _launch(x: Tensor, att_l: Tensor, att_r: Tensor, rowptr: Tensor,
+            col: Tensor, bias: Optional[Tensor], negative_slope: float, dropout: float):
+    N, H, C = x.shape
+    out = torch.empty((N, H, C), dtype=x.dtype, device=x.device)
+    lse = torch.empty((N, H), dtype=torch.float32, device=x.device)
+    seed = int(torch.randint(0, 2 ** 31 - 1, (1,)).item()) if dropout > 0 else 0
+
+    BLOCK_C = max(triton.next_power_of_2(C), 16)
+    BLOCK_N = 32
+    has_bias = bias is not None
+    _gat_csr_fwd[(N, H)](x, att_l.contiguous(), att_r.contiguous(), rowptr, col,
+                         bias if has_bias else out, out, lse, N, H, C, x.stride(0),
+                         negative_slope, dropout, seed,
+                         HAS_BIAS=has_bias,
+                         BIAS_PER_HEAD=has_bias and bias.numel() == H * C,
+                         BLOCK_C=BLOCK_C, BLOCK_N=BLOCK_N)
+    return out, lse, seed
+
+
+class GATCSRFunction(torch.autograd.Function):
+    @staticmethod
+    def forward(ctx, x, att_l, att_r, bias, rowptr, row, col, negative_slope, dropout,
+                csr32):
+        # the kernel reads the (possibly int32) copy of the CSR, the backward
+        # needs int64 indices for torch_scatter
+        k_rowptr, k_col = (rowptr, col) if csr32 is None else csr32
+        out, lse, seed = _launch(x, att_l, att_r, k_rowptr, k_col, bias, negative_slope, dropout)
+        ctx.save_for_backward(x, att_l, att_r, rowptr, row, col, lse)
+        ctx.bias_shape = None if bias is None else bias.shape
+        ctx.negative_slope = negative_slope
+        ctx.dropout = dropout
+        ctx.seed = seed
+        ctx.mark_non_differentiable(lse)
+        return out, lse
+
+    @staticmethod
+    def backward(ctx, grad_out, grad_lse):
+        x, att_l, att_r, rowptr, row, col, lse = ctx.saved_tensors
+        N, H, C = x.shape
+        xf, g = x.float(), grad_out.float()
+        att_lf, att_rf = att_l.float(), att_r.float()
+
+        # recompute the normalized attention of every edge from the saved
+        # logsumexp instead of a second softmax over the edges
+        z = (torch.einsum('nhc,hc->nh', xf, att_rf)[row]
+             + torch.einsum('nhc,hc->nh', xf, att_lf)[col])
+        alpha = torch.exp(F.leaky_relu(z, ctx.negative_slope) - lse[row])
+
+        g_dst = g[row]
+        # d loss / d alpha, with the dropout scaling of the forward pass
+        d_alpha = (g_dst * xf[col]).sum(dim=-1)
+        weight = alpha
+        if ctx.dropout > 0:
+            keep = torch.empty_like(alpha, dtype=torch.int8)
+            numel = keep.numel()
+            _dropout_keep[(triton.cdiv(numel, 1024),)](keep, numel, ctx.dropout,
+                                                       ctx.seed, BLOCK=1024)
+            scale = keep.float() / (1 - ctx.dropout)
+            d_alpha = d_alpha * scale
+            weight = alpha * scale
+
+        # softmax backward within each target's segment
+        d_e = alpha * (d_alpha - segment_csr(alpha * d_alpha, rowptr, reduce='sum')[row])
+        d_z = torch.where(z > 0, d_e, d_e * ctx.negative_slope)
+        d_s = segment_csr(d_z, rowptr, reduce='sum')
+        d_t = scatter_add(d_z, col, dim=0, dim_size=N)
+
+        grad_x = scatter_add(weight.unsqueeze(-1) * g_dst, col, dim=0, dim_size=N)
+        grad_x += d_s.unsqueeze(-1) * att_rf + d_t.unsqueeze(-1) * att_lf
+        grad_att_l = torch.einsum('nh,nhc->hc', d_t, xf)
+        grad_att_r = torch.einsum('nh,nhc->hc', d_s, xf)
+
+        grad_bias = None
+        if ctx.bias_shape is not None:
+            grad_bias = g.sum(dim=0)
+            if ctx.bias_shape.numel() != H * C:
+                grad_bias = grad_bias.sum(dim=0)
+            grad_bias = grad_bias.reshape(ctx.bias_shape)
+        return (grad_x.to(x.dtype), grad_att_l.to(att_l.dtype),
+                grad_att_r.to(att_r.dtype), grad_bias, None, None, None, None, None, None)
+
+
+def gat_csr_forward(x: Tensor, att_l: Tensor, att_r: Tensor, rowptr: Tensor,
+                    row: Tensor, col: Tensor, negative_slope: float,
+                    dropout: float = 0.0, bias: Optional[Tensor] = None,
+                    csr32: Optional[Tuple[Tensor, Tensor]] = None):
+    r"""Runs the fused kernel on projected features :obj:`x` of shape
+    :obj:`[N, H, C]` and a CSR adjacency whose rows are the target nodes.
+    Rows of :obj:`x` may be strided (e.g. a slice of a padded projection),
+    but each row must be contiguous. Returns the aggregated features
+    :obj:`[N, H, C]` and the per-row logsumexp :obj:`[N, H]` of the
+    attention logits. A :obj:`bias` of shape :obj:`[H * C]` or :obj:`[C]`
+    is added to every (head of every) output row. Differentiable with
+    respect to :obj:`x`, :obj:`att_l`, :obj:`att_r` and :obj:`bias`.
+    :obj:`csr32` optionally holds int32 copies of :obj:`(rowptr, col)` for
+    the kernel to read, halving the index traffic."""
+    N, H, C = x.shape
+    if x.stride(2) != 1 or x.stride(1) != C:
+        x = x.contiguous()
+    att_l, att_r = att_l.reshape(H, C), att_r.reshape(H, C)
+    return GATCSRFunction.apply(x, att_l, att_r, bias, rowptr, row, col,
+                                negative_slope, dropout, csr32)